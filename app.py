@@ -1,67 +1,225 @@
-from flask import Flask, request, jsonify
-import json
+from flask import Flask, Response, request
+import logging
+try:
+    import orjson
+except ImportError:  # orjsonが使えない環境では標準のjsonで代替する (loads/dumps/JSONDecodeErrorのみ使用)
+    import json as orjson
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
-from urllib.parse import parse_qs
-from typing import Dict, Any, List, Optional, Callable
+import os
+import time
+import threading
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, count
+from urllib.parse import unquote_plus
+from typing import Dict, Any, List, Optional, Callable, Tuple
 
 app = Flask(__name__)
 
+# 本番環境ではINFO以上のみ出力し、DEBUGログの整形コストを払わない
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 # 外部APIのURLを定数として定義 (現在動いているデータソース)
 EXTERNAL_API_BASE_URL = "https://api-teal-omega.vercel.app/get_data"
 
 # 💡 復号化に必要なJSファイルのURL
 PLAYER_JS_URL = "https://pokemogukunnsann.github.io/API-V2/base.js"
 
+# 取得したJSファイルをディスクにキャッシュする有効期間 (秒)。ワーカー間で共有される
+PLAYER_JS_CACHE_TTL = 6 * 60 * 60
+
+# メモリ上の復号化ロジックを再解析するまでの有効期間 (秒) と、再解析に失敗した場合の再試行間隔 (秒)
+DECIPHER_CACHE_TTL = 6 * 60 * 60
+DECIPHER_RETRY_INTERVAL = 60
+
+# 動画ごとのレスポンスをメモリにキャッシュする件数と有効期間 (秒)
+VIDEO_CACHE_MAXSIZE = 2048
+VIDEO_CACHE_TTL = 30 * 60
+
+# 外部APIとJSファイル取得で共有するHTTPセッション (Keep-AliveでTLSハンドシェイクを使い回す)
+HTTP_TIMEOUT = (3, 10)
+
+# 全リクエスト共通のヘッダー (モジュール読み込み時に一度だけ作成し、セッションに設定する)
+_BROWSER_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+_DEFAULT_HEADERS = {
+    "User-Agent": _BROWSER_UA,
+}
+
+SESSION = requests.Session()
+SESSION.headers.update(_DEFAULT_HEADERS)
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504])
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# (video_id, include_codecs) -> シリアライズ済みのレスポンス本文 (dictのまま保持するよりメモリが少なく、再シリアライズも不要)
+_video_cache: TTLCache = TTLCache(maxsize=VIDEO_CACHE_MAXSIZE, ttl=VIDEO_CACHE_TTL)
+_video_cache_lock = threading.Lock()
+
+# 外部APIの応答待ちの間に、JSファイルの取得・解析を先行して行うためのスレッドプール
+_prefetch_executor = ThreadPoolExecutor(max_workers=2)
+
 # -------------------------------------------------------------
 # 1. 署名復号化ヘルパー関数群 (Deciphering Logic)
 # -------------------------------------------------------------
 
-_decipher_cache = {}
+# JSファイルのURLごとに解析結果をキャッシュする (js_url -> {"funcs", "operations", "compiled_ops"})
+_decipher_cache: Dict[str, Dict[str, Any]] = {}
+# コールドスタート時に複数のスレッドが同じJSを重複して取得・解析しないためのロック
+_decipher_lock = threading.Lock()
+# 解析結果ごとの世代番号。再解析中も古い結果で復号化するスレッドがあるため、結果キャッシュのキーに含める
+_decipher_generation = count(1)
 
-def get_decipher_logic(js_url: str) -> Optional[Dict[str, Callable]]:
-    """JSコードから復号化のメイン関数とヘルパー関数を抽出・実行可能オブジェクトとして返す"""
-    print(f"  [DEBUG] 復号化ロジックキャッシュ確認中...")
-    if 'decipher_funcs' in _decipher_cache:
-        print("  [DEBUG] 復号化ロジックはキャッシュに存在します。")
-        return _decipher_cache['decipher_funcs']
+# 復号化ロジックの解析で使用する正規表現 (モジュール読み込み時に一度だけコンパイル)
+# ヘルパー関数オブジェクト (例: var A={...})
+_RE_HELPER_OBJ = re.compile(r'var\s+([a-zA-Z0-9$]+)=\s*\{([\s\S]+?)\};', re.MULTILINE)
+# メイン関数の本体 (パターン: function(a){a=a.split("")...})
+_RE_MAIN_FUNC = re.compile(r'a\.split\(""\);\s*(.*?);\s*return\s*a\.join\(""\)', re.DOTALL)
+# ヘルパーオブジェクト内の各関数定義
+_RE_HELPER_FUNCS = re.compile(r'([a-zA-Z0-9$]+)\s*:\s*function\s*\(a(?:,b)?\)\s*\{([\s\S]+?)\}')
+# 操作呼び出し (例: "A.b(a,3);")
+_RE_OP_CALL = re.compile(r'([a-zA-Z0-9$]+\.[a-zA-Z0-9$]+)\(a\s*(?:,\s*(\d+))?\)')
+# JSコード比較用に空白文字を取り除く変換テーブル
+_WS_DEL_TABLE = str.maketrans("", "", " \t\n\r\f\v")
 
-    print(f"  [STEP 2-1] 🔑 JSファイルダウンロード開始: {js_url}")
+def _player_js_cache_path(js_url: str) -> str:
+    """JSファイルのURLから、ディスクキャッシュのファイルパスを決定する"""
+    url_hash = hashlib.sha1(js_url.encode()).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f"player_js_{url_hash}.js")
+
+def load_player_js(js_url: str) -> Tuple[Optional[str], bool]:
+    """JSファイルをディスクキャッシュ (TTL付き) から読み込み、なければダウンロードする (戻り値: JSコード, ダウンロードしたか)"""
+    cache_path = _player_js_cache_path(js_url)
+    try:
+        if time.time() - os.path.getmtime(cache_path) < PLAYER_JS_CACHE_TTL:
+            with open(cache_path, encoding="utf-8") as f:
+                js_code = f.read()
+            logger.debug("  [DEBUG] JSファイルをディスクキャッシュから読み込みました: %s", cache_path)
+            return js_code, False
+    except OSError:
+        pass
+
+    logger.info("  [STEP 2-1] 🔑 JSファイルダウンロード開始: %s", js_url)
     try:
-        response = requests.get(js_url)
+        response = SESSION.get(js_url, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
         js_code = response.text
-        print("  [STEP 2-2] JSファイルダウンロード成功。解析を開始します。")
+        logger.debug("  [STEP 2-2] JSファイルダウンロード成功。解析を開始します。")
     except Exception as e:
-        print(f"  [ERROR] JSファイルダウンロードエラー: {e}")
+        logger.error("  [ERROR] JSファイルダウンロードエラー: %s", e)
+        return None, False
+
+    return js_code, True
+
+def save_player_js(js_url: str, js_code: str) -> None:
+    """解析に成功したJSファイルをディスクキャッシュに保存する"""
+    cache_path = _player_js_cache_path(js_url)
+    # 他のワーカーが書き込み途中のファイルを読まないよう、一時ファイル経由で置き換える
+    try:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(js_code)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning("  [WARN] JSファイルのディスクキャッシュ保存に失敗しました: %s", e)
+
+def get_decipher_logic(js_url: str) -> Optional[Dict[str, Callable]]:
+    """JSコードから復号化のメイン関数とヘルパー関数を抽出・実行可能オブジェクトとして返す"""
+    logger.debug("  [DEBUG] 復号化ロジックキャッシュ確認中...")
+    entry = _decipher_cache.get(js_url)
+    if entry and entry['expires'] > time.time():
+        logger.debug("  [DEBUG] 復号化ロジックはキャッシュに存在します。")
+        return entry['funcs']
+
+    if entry is None:
+        # 未解析の場合のみ、他のスレッドの解析完了をロックで待つ
+        _decipher_lock.acquire()
+    elif not _decipher_lock.acquire(blocking=False):
+        # 期限切れの場合は1スレッドだけが再解析し、他のスレッドは待たずに以前の解析結果を使う
+        logger.debug("  [DEBUG] 復号化ロジックを再解析中のため、以前の解析結果を使用します。")
+        return entry['funcs']
+
+    try:
+        # ロック待ちの間に他のスレッドが解析を終えている場合はそれを使う
+        entry = _decipher_cache.get(js_url)
+        if entry is None or entry['expires'] <= time.time():
+            new_entry = _parse_decipher_logic(js_url)
+            if new_entry is not None:
+                new_entry['expires'] = time.time() + DECIPHER_CACHE_TTL
+                new_entry['generation'] = next(_decipher_generation)
+                _decipher_cache[js_url] = entry = new_entry
+                # 操作リストが変わるため、以前の復号化結果は無効になる
+                decipher_signature.cache_clear()
+                logger.info("  [STEP 2-5] 復号化ロジックの解析とキャッシュが完了しました。")
+            elif entry is None:
+                return None
+            else:
+                # 一時的な取得失敗で出力を劣化させないよう、直前の正常な解析結果を使い続ける
+                entry['expires'] = time.time() + DECIPHER_RETRY_INTERVAL
+                logger.warning("  [WARN] 復号化ロジックの更新に失敗したため、以前の解析結果を使用します。")
+    finally:
+        _decipher_lock.release()
+
+    return entry['funcs']
+
+def _parse_decipher_logic(js_url: str) -> Optional[Dict[str, Any]]:
+    """JSファイルを取得・解析し、復号化ロジックのキャッシュエントリを作成する"""
+    js_code, downloaded = load_player_js(js_url)
+    if js_code is None:
         return None
 
+    entry = _parse_player_js(js_code)
+    if entry is None and not downloaded:
+        # ディスクキャッシュが解析できない場合は削除し、再試行のたびに同じファイルを読まないようにする
+        logger.warning("  [WARN] ディスクキャッシュのJSファイルを解析できないため、削除して再取得します。")
+        try:
+            os.remove(_player_js_cache_path(js_url))
+        except OSError:
+            pass
+        js_code, downloaded = load_player_js(js_url)
+        if js_code is None:
+            return None
+        entry = _parse_player_js(js_code)
+
+    # エラーページ等をワーカー間で共有しないよう、解析に成功したJSだけをディスクに保存する
+    if entry is not None and downloaded:
+        save_player_js(js_url, js_code)
+    return entry
+
+def _parse_player_js(js_code: str) -> Optional[Dict[str, Any]]:
+    """JSコードを解析し、復号化ロジックのキャッシュエントリを作成する"""
     # 1. ヘルパー関数オブジェクトの抽出 (例: var A={...})
-    helper_obj_match = re.search(r'var\s+([a-zA-Z0-9$]+)=\s*\{([\s\S]+?)\};', js_code, re.MULTILINE)
+    helper_obj_match = _RE_HELPER_OBJ.search(js_code)
     if not helper_obj_match: 
-        print("  [ERROR] ヘルパー関数オブジェクトの抽出に失敗しました。")
+        logger.error("  [ERROR] ヘルパー関数オブジェクトの抽出に失敗しました。")
         return None
     
     helper_obj_name = helper_obj_match.group(1)
     helper_funcs_str = helper_obj_match.group(2)
-    print(f"  [STEP 2-3] ヘルパーオブジェクト名 '{helper_obj_name}' を特定しました。")
+    logger.debug("  [STEP 2-3] ヘルパーオブジェクト名 '%s' を特定しました。", helper_obj_name)
 
     # 2. 🔑 メイン復号化関数の操作リストの抽出 (ロバスト化)
     
     # a. メイン関数の本体を特定
     # パターン: function(a){a=a.split("")...}
-    main_func_body_match = re.search(
-        r'a\.split\(""\);\s*(.*?);\s*return\s*a\.join\(""\)', 
-        js_code, 
-        re.DOTALL
-    )
+    main_func_body_match = _RE_MAIN_FUNC.search(js_code)
     
     if not main_func_body_match: 
-        print("  [ERROR] メイン復号化操作リストの抽出に失敗しました。")
+        logger.error("  [ERROR] メイン復号化操作リストの抽出に失敗しました。")
         return None
         
     main_func_body = main_func_body_match.group(1)
-    print(f"  [DEBUG] メイン関数本体を抽出しました。")
+    logger.debug("  [DEBUG] メイン関数本体を抽出しました。")
     
     # b. 抽出した関数本体から、ヘルパーオブジェクトを使用した操作呼び出しのみを抽出
     # 操作は `オブジェクト名.関数名(a, パラメータ);` の形式を複数回繰り返す
@@ -71,7 +229,7 @@ def get_decipher_logic(js_url: str) -> Optional[Dict[str, Callable]]:
     )
     
     if not operation_list:
-        print("  [ERROR] 抽出された関数本体から操作リストを特定できませんでした。")
+        logger.error("  [ERROR] 抽出された関数本体から操作リストを特定できませんでした。")
         return None
         
     operations = operation_list
@@ -79,18 +237,24 @@ def get_decipher_logic(js_url: str) -> Optional[Dict[str, Callable]]:
     # 3. Pythonで実行可能なヘルパー関数を定義
     decipher_funcs: Dict[str, Callable] = {}
     
-    def func_splice(arr: list, index: int) -> list: del arr[:index]; return arr
-    def func_reverse(arr: list, *args) -> list: arr.reverse(); return arr
-    def func_swap(arr: list, index: int) -> list:
-        if not arr: return arr
-        index = index % len(arr)
-        temp = arr[0]
-        arr[0] = arr[index]
-        arr[index] = temp
-        return arr
+    # 状態は [文字配列, 先頭オフセット] の形で受け渡す
+    # spliceはリストを縮めず先頭オフセットを進めるだけにする (O(n)のメモリ移動を回避)
+    def func_splice(state: list, index: int) -> list:
+        state[1] = min(state[1] + index, len(state[0])); return state
+    def func_reverse(state: list, *args) -> list:
+        arr, start = state
+        arr[start:] = arr[start:][::-1]
+        return state
+    def func_swap(state: list, index: int) -> list:
+        arr, start = state
+        length = len(arr) - start
+        if not length: return state
+        index = start + index % length
+        arr[start], arr[index] = arr[index], arr[start]
+        return state
 
     # 4. JSコードを解析し、Python関数にマッピング
-    helper_funcs = re.findall(r'([a-zA-Z0-9$]+)\s*:\s*function\s*\(a(?:,b)?\)\s*\{([\s\S]+?)\}', helper_funcs_str)
+    helper_funcs = _RE_HELPER_FUNCS.findall(helper_funcs_str)
     
     patterns_map = {
         'splice': ('a.splice(0,b)', func_splice),
@@ -98,179 +262,270 @@ def get_decipher_logic(js_url: str) -> Optional[Dict[str, Callable]]:
         'swap': ('var c=a[0];a[0]=a[b%a.length];a[b%a.length]=c', func_swap) 
     }
     
+    # パターン側の空白除去はヘルパー関数ごとに繰り返さず、ここで一度だけ行う
+    clean_patterns = [(key, pattern.translate(_WS_DEL_TABLE), func) for key, (pattern, func) in patterns_map.items()]
+    
     for func_name, func_body in helper_funcs:
-        clean_body = ''.join(func_body.split())
+        clean_body = func_body.translate(_WS_DEL_TABLE)
         
-        for key, (pattern, func) in patterns_map.items():
-            if ''.join(pattern.split()) in clean_body:
+        for key, clean_pattern, func in clean_patterns:
+            if clean_pattern in clean_body:
                 decipher_funcs[f"{helper_obj_name}.{func_name}"] = func
-                print(f"  [DEBUG] {key.upper()}関数を '{helper_obj_name}.{func_name}' にマッピングしました。")
+                logger.debug("  [DEBUG] %s関数を '%s.%s' にマッピングしました。", key.upper(), helper_obj_name, func_name)
                 break
     
-    _decipher_cache['decipher_funcs'] = decipher_funcs
-    # operation_listは既にセミコロン付きなのでそのまま格納
-    _decipher_cache['operations'] = [op.strip() for op in operations if op.strip()]
-    print(f"  [STEP 2-4] 抽出されたデサイファリング操作の数: {len(_decipher_cache['operations'])} 個")
-    print("  [STEP 2-5] 復号化ロジックの解析とキャッシュが完了しました。")
-    
-    return _decipher_cache['decipher_funcs']
-
-def decipher_signature(s_cipher: str, js_url: str) -> Optional[str]:
-    """暗号化された署名を復号化し、署名文字列を返す"""
-    print(f"  [STEP 3-1] 署名復号化を開始します。s_cipherの長さ: {len(s_cipher)}")
-    if not get_decipher_logic(js_url):
-        print("  [ERROR] 復号化ロジックの取得に失敗したため、署名復号化を中断します。")
-        return None
-        
-    decipher_funcs = _decipher_cache['decipher_funcs']
-    operations = _decipher_cache['operations']
-
-    signature_array = list(s_cipher)
-    op_count = 0
-    
+    # 5. 操作リストを (Python関数, パラメータ) のタプルに事前コンパイル
+    # 署名ごとに正規表現や辞書検索を繰り返さないよう、ここで一度だけ解析する
+    compiled_ops: List[Tuple[Callable, int]] = []
     for op in operations:
         # opは "A.b(a,3);" のような文字列
-        func_call = re.match(r'([a-zA-Z0-9$]+\.[a-zA-Z0-9$]+)\(a\s*(?:,\s*(\d+))?\)', op)
-        
+        func_call = _RE_OP_CALL.match(op.strip())
         if not func_call:
             continue
 
         func_name = func_call.group(1)
         param_str = func_call.group(2)
-        param = int(param_str) if param_str else 0 
-
         if func_name in decipher_funcs:
-            print(f"  [DEBUG] 適用操作: {func_name}, パラメータ: {param}, 配列の長さ: {len(signature_array)}")
-            
-            decipher_funcs[func_name](signature_array, param)
-            op_count += 1
+            compiled_ops.append((decipher_funcs[func_name], int(param_str) if param_str else 0))
+
+    # operation_listは既にセミコロン付きなのでそのまま格納
+    operations = [op.strip() for op in operations if op.strip()]
+    logger.debug("  [STEP 2-4] 抽出されたデサイファリング操作の数: %d 個 (適用可能: %d 個)", len(operations), len(compiled_ops))
     
-    deciphered_sig = "".join(signature_array)
-    print(f"  [STEP 3-2] 復号化操作を {op_count} 回適用しました。")
-    print(f"  [STEP 3-3] 復号化された署名 (sig) の長さ: {len(deciphered_sig)}")
+    return {
+        "funcs": decipher_funcs,
+        "operations": operations,
+        "compiled_ops": compiled_ops,
+    }
+
+@lru_cache(maxsize=256)
+def _decipher_index_map(js_url: str, generation: int, length: int) -> Tuple[int, ...]:
+    """指定した長さの署名について、復号化後の各文字が元のどの位置から来るかを返す"""
+    # splice / reverse / swap はいずれも文字の位置を入れ替えるだけなので、
+    # 長さごとに一度インデックス列へ操作を適用すれば、以降は並べ替えるだけで済む
+    state = [list(range(length)), 0]
+    for func, param in _decipher_cache[js_url]['compiled_ops']:
+        func(state, param)
+
+    index_array, start = state
+    return tuple(index_array[start:])
+
+@lru_cache(maxsize=4096)
+def _decipher_signature_cached(s_cipher: str, js_url: str, generation: int) -> str:
+    """キャッシュ済みの復号化操作を適用する (get_decipher_logicで準備済みであることが前提)"""
+    index_map = _decipher_index_map(js_url, generation, len(s_cipher))
+    deciphered_sig = "".join(map(s_cipher.__getitem__, index_map))
+    logger.debug("  [STEP 3-2] 復号化操作を %d 回適用しました。", len(_decipher_cache[js_url]['compiled_ops']))
+    logger.debug("  [STEP 3-3] 復号化された署名 (sig) の長さ: %d", len(deciphered_sig))
     
     return deciphered_sig
 
+def _clear_decipher_results() -> None:
+    _decipher_signature_cached.cache_clear()
+    _decipher_index_map.cache_clear()
+
+def decipher_signature(s_cipher: str, js_url: str) -> Optional[str]:
+    """暗号化された署名を復号化し、署名文字列を返す"""
+    logger.debug("  [STEP 3-1] 署名復号化を開始します。s_cipherの長さ: %d", len(s_cipher))
+    if not get_decipher_logic(js_url):
+        logger.error("  [ERROR] 復号化ロジックの取得に失敗したため、署名復号化を中断します。")
+        return None
+        
+    return _decipher_signature_cached(s_cipher, js_url, _decipher_cache[js_url]['generation'])
+
+# 復号化ロジックを再解析した際に結果キャッシュを破棄するためのフック
+decipher_signature.cache_clear = _clear_decipher_results
+
 # -------------------------------------------------------------
-# 2. データ整理ヘルパー (変更なし)
+# 2. データ整理ヘルパー
 # -------------------------------------------------------------
 
-def extract_stream_info(format_data: Dict[str, Any]) -> Dict[str, Any]:
+def parse_signature_cipher(signature_cipher: str) -> Tuple[Optional[str], Optional[str], str]:
+    """signatureCipher から必要な url / s / sp だけを取り出す (parse_qsより軽量)"""
+    base_url = s_cipher = sp = None
+    for kv in signature_cipher.split("&"):
+        key, _, value = kv.partition("=")
+        # parse_qsと同様に、空の値は無視し、同じキーは最初の値を採用する
+        if not value:
+            continue
+        if key == "url":
+            if base_url is None: base_url = unquote_plus(value)
+        elif key == "s":
+            if s_cipher is None: s_cipher = unquote_plus(value)
+        elif key == "sp":
+            if sp is None: sp = unquote_plus(value)
+    return base_url, s_cipher, sp or "sig"
+
+def extract_stream_info(format_data: Dict[str, Any], include_codecs: bool = True) -> Dict[str, Any]:
+    g = format_data.get
+    mime = g("mimeType")
+    url = g("url")
     stream_info: Dict[str, Any] = {
-        "itag": format_data.get("itag"),
-        "mimeType": format_data.get("mimeType"),
-        "qualityLabel": format_data.get("qualityLabel", format_data.get("quality")),
+        "itag": g("itag"),
+        "mimeType": mime,
+        "qualityLabel": g("qualityLabel", g("quality")),
         "is_ciphered": False,
-        "is_playable": False,
-        "url": None,
+        # 署名済みのURLがそのまま提供されていれば再生可能
+        "is_playable": url is not None and "sig" in url,
+        "url": url,
         "s_cipher": None 
     }
 
-    if "url" in format_data and "sig" in format_data["url"]:
-        stream_info["url"] = format_data["url"]
-        stream_info["is_playable"] = True
-    elif "url" in format_data:
-        stream_info["url"] = format_data["url"]
-
-    if "signatureCipher" in format_data:
+    signature_cipher = g("signatureCipher")
+    if signature_cipher is not None:
         stream_info["is_ciphered"] = True
-        cipher_params = parse_qs(format_data["signatureCipher"])
-        
-        base_url = cipher_params.get("url", [None])[0]
+        base_url, stream_info["s_cipher"], stream_info["sp"] = parse_signature_cipher(signature_cipher)
         if base_url:
             stream_info["url"] = base_url
-            
-        stream_info["s_cipher"] = cipher_params.get("s", [None])[0]
-        stream_info["sp"] = cipher_params.get("sp", ["sig"])[0]
 
-    stream_info["container"] = stream_info["mimeType"].split(";")[0].split("/")[-1]
-    stream_info["vcodec"] = format_data.get("vcodec")
-    stream_info["acodec"] = format_data.get("acodec")
+    # コーデック情報が不要なクライアント (?fields=minimal) では計算を省略する
+    if include_codecs:
+        stream_info["container"] = mime.partition(";")[0].rpartition("/")[2] if mime else None
+        stream_info["vcodec"] = g("vcodec")
+        stream_info["acodec"] = g("acodec")
     return stream_info
 
 # -------------------------------------------------------------
-# 3. Flask ルート定義 (変更なし)
+# 3. Flask ルート定義
 # -------------------------------------------------------------
 
+# YouTubeの動画IDは英数字と '-' '_' からなる11文字
+_RE_VIDEO_ID = re.compile(r'[A-Za-z0-9_-]{11}')
+
+def json_response(payload: Dict[str, Any], status: int = 200) -> Response:
+    """orjsonでシリアライズしたJSONレスポンスを返す (jsonifyより高速)"""
+    return Response(orjson.dumps(payload), status=status, mimetype="application/json")
+
 @app.route("/parse_final", methods=['GET'])
 def parse_final_api():
     video_id = request.args.get('id')
+    include_codecs = request.args.get('fields') != "minimal"
     
     if not video_id:
-        print("[ERROR] Video IDが指定されていません。")
-        return jsonify({"status": "error", "message": "Video ID (id) is required."}), 400
+        logger.warning("[ERROR] Video IDが指定されていません。")
+        return json_response({"status": "error", "message": "Video ID (id) is required."}, 400)
+
+    # 形式が不正なIDは、外部APIへ問い合わせる前に弾く
+    if not _RE_VIDEO_ID.fullmatch(video_id):
+        logger.warning("[ERROR] 不正なVideo IDです: %r", video_id)
+        return json_response({"status": "error", "message": "Invalid video ID."}, 400)
 
-    print(f"==================================================")
-    print(f"[START] 処理開始: Video ID = {video_id}")
+    logger.info("==================================================")
+    logger.info("[START] 処理開始: Video ID = %s", video_id)
+    
+    # 同じ動画への繰り返しのリクエストは、外部APIへの問い合わせと解析を丸ごと省略する
+    cache_key = (video_id, include_codecs)
+    with _video_cache_lock:
+        cached_body = _video_cache.get(cache_key)
+    if cached_body is not None:
+        logger.info("[END] キャッシュ済みのレスポンスを返します: Video ID = %s", video_id)
+        return Response(cached_body, mimetype="application/json")
+    
+    # コールドスタート時は、JSファイルの取得・解析を外部APIへのリクエストと並行して進める
+    decipher_warmup = None
+    if PLAYER_JS_URL not in _decipher_cache:
+        decipher_warmup = _prefetch_executor.submit(get_decipher_logic, PLAYER_JS_URL)
     
     target_url = f"{EXTERNAL_API_BASE_URL}?id={video_id}"
-    print(f"[STEP 1-1] 🚀 外部APIへデータ取得リクエスト: {target_url}")
+    logger.debug("[STEP 1-1] 🚀 外部APIへデータ取得リクエスト: %s", target_url)
     
     try:
-        response = requests.get(target_url)
+        response = SESSION.get(target_url, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
-        innertube_response: Dict[str, Any] = response.json()
+        innertube_response: Dict[str, Any] = orjson.loads(response.content)
         
-        # ご要望のprint文
-        print(f"レスポンス: {response}")
-        print(f"Innertubeレスポンス (JSON): {json.dumps(innertube_response, indent=2)}")
+        # ご要望のレスポンス出力 (DEBUGレベル時のみ。巨大なJSONの整形を本番で行わない)
+        logger.debug("レスポンス: %s", response)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Innertubeレスポンス (JSON): %s", innertube_response)
         
-        print("[STEP 1-2] 外部APIからのデータ取得成功。JSONを解析します。")
+        logger.debug("[STEP 1-2] 外部APIからのデータ取得成功。JSONを解析します。")
         
-    except requests.exceptions.RequestException as e:
-        print(f"[FATAL] 外部APIからのデータ取得中にエラーが発生: {e}")
-        return jsonify({"status": "error", "message": f"Failed to fetch data from external API: {e}"}), 502
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        logger.error("[FATAL] 外部APIからのデータ取得中にエラーが発生: %s", e)
+        return json_response({"status": "error", "message": f"Failed to fetch data from external API: {e}"}, 502)
 
     status = innertube_response.get("playabilityStatus", {}).get("status")
     if status in ["LOGIN_REQUIRED", "UNPLAYABLE"]:
-        print(f"[BLOCK] ⚠️ YouTubeブロック検出: status={status}")
-        return jsonify({"status": "remote_error", "message": "External API or YouTube block detected.", "details": innertube_response}), 403
+        logger.warning("[BLOCK] ⚠️ YouTubeブロック検出: status=%s", status)
+        return json_response({"status": "remote_error", "message": "External API or YouTube block detected.", "details": innertube_response}, 403)
 
     streaming_data = innertube_response.get("streamingData", {})
-    all_formats: List[Dict[str, Any]] = streaming_data.get("formats", []) + streaming_data.get("adaptiveFormats", [])
-    
-    print(f"[STEP 1-3] ストリーム情報を整理します。合計 {len(all_formats)} 個のフォーマットが見つかりました。")
+    # formats と adaptiveFormats を連結したリストを作らず、そのまま順に処理する
+    all_formats = chain(streaming_data.get("formats") or (), streaming_data.get("adaptiveFormats") or ())
+    stream_list: List[Dict[str, Any]] = [extract_stream_info(fmt, include_codecs) for fmt in all_formats]
     
-    stream_list: List[Dict[str, Any]] = []
+    logger.debug("[STEP 1-3] ストリーム情報を整理します。合計 %d 個のフォーマットが見つかりました。", len(stream_list))
+    ciphered_streams: List[Tuple[int, Dict[str, Any]]] = []
     
-    for i, fmt in enumerate(all_formats):
-        stream_info = extract_stream_info(fmt)
-        
+    for i, stream_info in enumerate(stream_list):
         if stream_info["is_ciphered"] and stream_info["s_cipher"] and stream_info["url"]:
-            print(f"[STREAM {i+1}] 🔐 暗号化されたストリームです (itag: {stream_info['itag']})。復号化が必要です...")
-            
-            deciphered_sig = decipher_signature(stream_info["s_cipher"], PLAYER_JS_URL)
+            logger.debug("[STREAM %d] 🔐 暗号化されたストリームです (itag: %s)。復号化が必要です...", i+1, stream_info['itag'])
+            ciphered_streams.append((i, stream_info))
+        
+        elif stream_info["url"]:
+            stream_info["final_playable_url"] = stream_info["url"]
+            stream_info["is_playable"] = True
+            logger.debug("[STREAM %d] 🟢 再生可能なURLが直接提供されています (itag: %s)。", i+1, stream_info['itag'])
+
+    decipher_ok = True
+    if ciphered_streams:
+        # 先行して開始したJSファイルの取得・解析があれば、その完了を待つ
+        if decipher_warmup is not None:
+            decipher_funcs = decipher_warmup.result()
+        else:
+            decipher_funcs = get_decipher_logic(PLAYER_JS_URL)
+
+        # 同一の s_cipher は一度だけ復号化し、結果を各ストリームに割り当てる
+        unique_ciphers = {stream_info["s_cipher"] for _, stream_info in ciphered_streams}
+        if decipher_funcs:
+            # 復号化はキャッシュ済みのインデックス列による並べ替えだけなので、スレッドを使わずその場で行う
+            decoded: Dict[str, Optional[str]] = {
+                s_cipher: decipher_signature(s_cipher, PLAYER_JS_URL) for s_cipher in unique_ciphers
+            }
+        else:
+            # 復号化ロジックを取得できなかった場合は、署名ごとにJSの再取得を試みず全て失敗とする
+            logger.error("[ERROR] 復号化ロジックの取得に失敗したため、暗号化ストリームの復号化を省略します。")
+            decoded = dict.fromkeys(unique_ciphers)
+        decipher_ok = all(decoded.values())
+
+        for i, stream_info in ciphered_streams:
+            deciphered_sig = decoded[stream_info["s_cipher"]]
             
             if deciphered_sig:
-                final_url = f"{stream_info['url']}&{stream_info.get('sp', 'sig')}={deciphered_sig}"
-                stream_info["final_playable_url"] = final_url 
+                sp = stream_info.get("sp") or "sig"
+                stream_info["final_playable_url"] = "".join((stream_info["url"], "&", sp, "=", deciphered_sig))
                 stream_info["is_playable"] = True
-                print(f"[STREAM {i+1}] ✅ 復号化成功！最終URLが生成されました。")
+                logger.debug("[STREAM %d] ✅ 復号化成功！最終URLが生成されました。", i+1)
             else:
                 stream_info["final_playable_url"] = "Deciphering Failed"
-                print(f"[STREAM {i+1}] ❌ 復号化に失敗しました。")
-        
-        elif stream_info["url"]:
-            stream_info["final_playable_url"] = stream_info["url"]
-            stream_info["is_playable"] = True
-            print(f"[STREAM {i+1}] 🟢 再生可能なURLが直接提供されています (itag: {stream_info['itag']})。")
-        
-        stream_list.append(stream_info)
+                logger.warning("[STREAM %d] ❌ 復号化に失敗しました。", i+1)
 
-    print(f"[END] 処理完了。{len(stream_list)}個のストリーム情報を返します。")
-    print(f"==================================================")
-    return jsonify({
+    payload = {
         "status": "success",
         "videoId": video_id,
         "videoTitle": innertube_response.get("videoDetails", {}).get("title"),
         "playerJsUrl": PLAYER_JS_URL,
         "stream_count": len(stream_list),
         "streams": stream_list
-    })
+    }
+    body = orjson.dumps(payload)
+    # 再生可能 (OK) かつ全ストリームの復号化に成功した結果のみキャッシュする
+    with _video_cache_lock:
+        if status == "OK" and decipher_ok:
+            _video_cache[cache_key] = body
+        else:
+            _video_cache.pop(cache_key, None)
+
+    logger.info("[END] 処理完了。%d個のストリーム情報を返します。", len(stream_list))
+    logger.info("==================================================")
+    return Response(body, mimetype="application/json")
 
 # -------------------------------------------------------------
 # 4. アプリケーション実行
 # -------------------------------------------------------------
 
+# 本番環境では gunicorn で起動する: gunicorn -c gunicorn_conf.py app:app
+# 以下はローカル確認用の開発サーバー (デバッグモードは FLASK_DEBUG=1 のときのみ有効)
 if __name__ == "__main__":
-    app.run(port=5001, debug=True)
+    app.run(port=5001, debug=os.environ.get("FLASK_DEBUG") == "1")
@@ -0,0 +1,24 @@
+# 本番用の gunicorn 設定 (Vercel では使用しない)
+# 依存パッケージ: pip install -r requirements-server.txt
+# 起動例: gunicorn -c gunicorn_conf.py app:app
+# GUNICORN_WORKER_CLASS=gthread を指定すると、gevent の代わりにスレッドワーカーで起動する
+# ※ モードの切り替えは必ず GUNICORN_WORKER_CLASS で行うこと。-k / --worker-class で上書きすると
+#    preload_app の設定がワーカーの種類と食い違う
+
+import os
+
+# 処理の大半は外部APIの応答待ちなので、gevent (またはスレッド) ワーカーで多数のリクエストを同時に捌く
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5001")
+
+workers = 2 * (os.cpu_count() or 1) + 1
+worker_connections = 1000
+# gthread ワーカー使用時のワーカーあたりのスレッド数
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+
+# gevent ワーカーは起動時に自身で標準ライブラリをパッチするため、app はパッチ後にワーカー内で読み込む
+# (マスターで先に読み込むと requests / ssl がパッチ前に import されてしまう)
+# それ以外のワーカーでは app の読み込み (正規表現のコンパイル等) をマスターで一度だけ行い、コピーオンライトで共有する
+preload_app = worker_class != "gevent"
+keepalive = 30